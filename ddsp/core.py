@@ -18,7 +18,7 @@
 
 import collections
 import copy
-from typing import Any, Dict, Sequence, Text, TypeVar
+from typing import Any, Callable, Dict, Optional, Sequence, Text, TypeVar
 
 import gin
 import numpy as np
@@ -334,6 +334,7 @@ def frequencies_softmax(freqs: tf.Tensor,
   Returns:
     A tensor of frequencies in hertz [batch, time, n_sinusoids].
   """
+  freqs = tf_float32(freqs)
   if len(freqs.shape) == 3:
     # Add depth: [B, T, N*D] -> [B, T, N, D]
     freqs = _add_depth_axis(freqs, depth)
@@ -343,12 +344,11 @@ def frequencies_softmax(freqs: tf.Tensor,
   # Probs: [B, T, N, D].
   f_probs = tf.nn.softmax(freqs, axis=-1)
 
-  # [1, 1, 1, D]
-  unit_bins = tf.linspace(0.0, 1.0, depth)
-  unit_bins = unit_bins[tf.newaxis, tf.newaxis, tf.newaxis, :]
+  # [D]
+  unit_bins = np.linspace(0.0, 1.0, depth, dtype=np.float32)
 
-  # [B, T, N]
-  f_unit = tf.reduce_sum(unit_bins * f_probs, axis=-1, keepdims=False)
+  # Expected value of the bins, without a [B, T, N, D] product. [B, T, N]
+  f_unit = tf.tensordot(f_probs, unit_bins, axes=[[-1], [0]])
   return unit_to_hz(f_unit, hz_min=hz_min, hz_max=hz_max)
 
 
@@ -772,6 +772,66 @@ def remove_above_nyquist(frequency_envelopes: tf.Tensor,
   return amplitude_envelopes
 
 
+@tf.function(jit_compile=True)
+def scaled_remove_above_nyquist(frequency_envelopes: tf.Tensor,
+                                amplitude_envelopes: tf.Tensor,
+                                sample_rate: int = 16000,
+                                scale_fn: Optional[Callable] = None
+                               ) -> tf.Tensor:
+  """Scale amplitudes and set amplitudes above nyquist to 0, in one kernel.
+
+  Same as `remove_above_nyquist(freqs, scale_fn(amps), sample_rate)`, but
+  compiled together so the amplitudes are read and written once.
+
+  Args:
+    frequency_envelopes: Sample-wise oscillator frequencies (Hz). Shape
+      [batch_size, n_samples, n_sinusoids].
+    amplitude_envelopes: Sample-wise oscillator amplitude, before scaling.
+      Shape [batch_size, n_samples, n_sinusoids].
+    sample_rate: Sample rate in samples per a second.
+    scale_fn: Optional function applied to the amplitudes before masking.
+
+  Returns:
+    amplitude_envelopes: Sample-wise scaled and filtered oscillator amplitude.
+      Shape [batch_size, n_samples, n_sinusoids].
+  """
+  amplitude_envelopes = tf_float32(amplitude_envelopes)
+  if scale_fn is not None:
+    amplitude_envelopes = scale_fn(amplitude_envelopes)
+  return remove_above_nyquist(frequency_envelopes, amplitude_envelopes,
+                              sample_rate)
+
+
+def softmax_below_nyquist(frequency_envelopes: tf.Tensor,
+                          logits: tf.Tensor,
+                          sample_rate: int = 16000) -> tf.Tensor:
+  """Softmax over oscillators, with zero probability for those above nyquist.
+
+  Like `remove_above_nyquist()` followed by normalizing with `safe_divide()`,
+  frames where every oscillator is above nyquist are all zeros.
+
+  Args:
+    frequency_envelopes: Sample-wise oscillator frequencies (Hz). Shape
+      [batch_size, n_samples, n_sinusoids].
+    logits: Sample-wise unnormalized log probabilities of each oscillator.
+      Shape [batch_size, n_samples, n_sinusoids].
+    sample_rate: Sample rate in samples per a second.
+
+  Returns:
+    probs: Sample-wise oscillator distribution, normalized in the last
+      dimension. Shape [batch_size, n_samples, n_sinusoids].
+  """
+  frequency_envelopes = tf_float32(frequency_envelopes)
+  logits = tf_float32(logits)
+
+  below_nyquist = tf.less(frequency_envelopes, sample_rate / 2.0)
+  # Large negative logits get zero probability from the softmax.
+  logits = tf.where(below_nyquist, logits, -1e9 * tf.ones_like(logits))
+  probs = tf.nn.softmax(logits, axis=-1)
+  # Frames with every logit masked would otherwise be uniform.
+  return probs * tf.cast(below_nyquist, tf.float32)
+
+
 # TODO(jesseengel): Remove reliance on global injection for angular cumsum.
 @gin.configurable
 def oscillator_bank(frequency_envelopes: tf.Tensor,
@@ -828,12 +888,16 @@ def oscillator_bank(frequency_envelopes: tf.Tensor,
 
 
 def get_harmonic_frequencies(frequencies: tf.Tensor,
-                             n_harmonics: int) -> tf.Tensor:
+                             n_harmonics: int,
+                             f_ratios=None) -> tf.Tensor:
   """Create integer multiples of the fundamental frequency.
 
   Args:
     frequencies: Fundamental frequencies (Hz). Shape [batch_size, :, 1].
     n_harmonics: Number of harmonics.
+    f_ratios: Optional precomputed harmonic numbers [1, ..., n_harmonics],
+      shape [n_harmonics]. Lets callers reuse the same ratios across calls
+      instead of building them each time.
 
   Returns:
     harmonic_frequencies: Oscillator frequencies (Hz).
@@ -841,7 +905,10 @@ def get_harmonic_frequencies(frequencies: tf.Tensor,
   """
   frequencies = tf_float32(frequencies)
 
-  f_ratios = tf.linspace(1.0, float(n_harmonics), int(n_harmonics))
+  if f_ratios is None:
+    f_ratios = tf.linspace(1.0, float(n_harmonics), int(n_harmonics))
+  else:
+    f_ratios = tf_float32(f_ratios)
   f_ratios = f_ratios[tf.newaxis, tf.newaxis, :]
   harmonic_frequencies = frequencies * f_ratios
   return harmonic_frequencies
@@ -1359,6 +1426,84 @@ def frequency_filter(audio: tf.Tensor,
   return fft_convolve(audio, impulse_response, padding=padding)
 
 
+def random_phase_noise(magnitudes: tf.Tensor,
+                       n_samples: int,
+                       seed: Optional[tf.Tensor] = None) -> tf.Tensor:
+  """Synthesize filtered noise directly in the frequency domain.
+
+  Instead of generating white noise and convolving it with a filter, give each
+  frequency bin of a frame the filter magnitude and a random phase, and take a
+  single inverse FFT. Frames overlap by 50% and are windowed with a square-root
+  hann window, which keeps the noise power constant across frame boundaries.
+  In expectation, the output has the same power spectrum as frequency_filter()
+  applied to uniform white noise in the range [-1, 1].
+
+  Args:
+    magnitudes: Frequency transfer curve. Float32 Tensor of shape [batch,
+      n_frames, n_frequencies] or [batch, n_frequencies]. The frequencies of the
+      last dimension are ordered as [0, f_nyqist / (n_frequencies -1), ...,
+      f_nyquist], where f_nyquist is (sample_rate / 2). Automatically splits the
+      audio into equally sized frames to match frames in magnitudes.
+    n_samples: Number of audio samples to generate.
+    seed: Optional shape [2] seed for tf.random.stateless_uniform(). The same
+      seed always gives the same phases. If None, uses the global generator.
+
+  Returns:
+    Filtered noise. Tensor of shape [batch, n_samples].
+  """
+  magnitudes = tf_float32(magnitudes)
+
+  # Add a frame dimension to magnitudes if it doesn't have one.
+  if len(magnitudes.shape) == 2:
+    magnitudes = magnitudes[:, tf.newaxis, :]
+
+  n_frames = int(magnitudes.shape[1])
+  hop_size = int(np.ceil(n_samples / n_frames))
+  frame_size = 2 * hop_size
+  n_bins = frame_size // 2 + 1
+
+  # Hold the first and last frames so every output sample is covered by two
+  # overlapping windows.
+  magnitudes = tf.concat([magnitudes[:, :1, :],
+                          magnitudes,
+                          magnitudes[:, -1:, :]], axis=1)
+
+  # Interpolate the transfer curve to the frequency bins of a frame.
+  magnitudes = tf.transpose(magnitudes, [0, 2, 1])
+  magnitudes = resample(magnitudes, n_bins, add_endpoint=False)
+  magnitudes = tf.transpose(magnitudes, [0, 2, 1])
+
+  # Uniform noise in [-1, 1] has a variance of 1/3. Match it, accounting for
+  # the 1/frame_size normalization of the inverse FFT.
+  magnitudes *= np.sqrt(frame_size / 3.0)
+
+  # Random phase, except at DC and nyquist which must be real. Those get a
+  # random sign (a phase of 0 or pi), so they don't add a constant offset.
+  if seed is None:
+    phase = tf.random.uniform(tf.shape(magnitudes),
+                              minval=-np.pi, maxval=np.pi)
+  else:
+    phase = tf.random.stateless_uniform(tf.shape(magnitudes), seed=seed,
+                                        minval=-np.pi, maxval=np.pi)
+  is_real_bin = np.zeros([n_bins], dtype=bool)
+  is_real_bin[[0, -1]] = True
+  random_sign_phase = np.pi * tf.cast(phase > 0.0, tf.float32)
+  phase = tf.where(is_real_bin, random_sign_phase, phase)
+  spectrum = tf.complex(magnitudes * tf.cos(phase),
+                        magnitudes * tf.sin(phase))
+
+  # Synthesize windowed frames and overlap-add them together.
+  frames = tf.signal.irfft(spectrum, [frame_size])
+  window = tf.sqrt(tf.signal.hann_window(frame_size, periodic=True))
+  frames *= window[tf.newaxis, tf.newaxis, :]
+  audio = tf.signal.overlap_and_add(frames, hop_size)
+
+  # Frame i is centered at (i + 1) * hop_size, and corresponds to input frame
+  # (i - 1), which is centered at (i - 1/2) * hop_size of the output.
+  start = (3 * hop_size) // 2
+  return audio[:, start:start + n_samples]
+
+
 def sinc_filter(audio: tf.Tensor,
                 cutoff_frequency: tf.Tensor,
                 window_size: int = 512,
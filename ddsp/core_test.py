@@ -118,6 +118,40 @@ class UtilitiesTest(parameterized.TestCase, tf.test.TestCase):
     self.assertAllClose(sin_freqs[..., 1], f0_hz * 2)
     self.assertAllClose(sin_freqs[..., 2], f0_hz * 3)
 
+  def test_scaled_remove_above_nyquist_matches_unfused(self):
+    frequencies = np.linspace(0.0, 16000.0, 20).reshape(1, 2, 10)
+    amplitudes = np.random.randn(1, 2, 10).astype(np.float32)
+
+    fused = core.scaled_remove_above_nyquist(
+        frequencies, amplitudes, 16000, scale_fn=core.exp_sigmoid)
+    unfused = core.remove_above_nyquist(
+        frequencies, core.exp_sigmoid(amplitudes), 16000)
+
+    self.assertAllClose(unfused, fused)
+
+  def test_softmax_below_nyquist_masks_and_normalizes(self):
+    # Second frame is entirely above nyquist.
+    frequencies = np.array([[[100.0, 4000.0, 9000.0],
+                             [8000.0, 9000.0, 10000.0]]], dtype=np.float32)
+    logits = np.random.randn(1, 2, 3).astype(np.float32)
+
+    probs = core.softmax_below_nyquist(frequencies, logits, 16000)
+
+    expected = np.exp(logits[0, 0, :2]) / np.sum(np.exp(logits[0, 0, :2]))
+    self.assertAllClose(expected, probs[0, 0, :2])
+    self.assertAllEqual(np.zeros([1]), probs[0, 0, 2:])
+    self.assertAllEqual(np.zeros([3]), probs[0, 1])
+
+  def test_frequencies_softmax_accepts_bfloat16(self):
+    freqs = np.random.randn(2, 10, 4 * 8).astype(np.float32)
+
+    hz_bf16 = core.frequencies_softmax(tf.cast(freqs, tf.bfloat16), depth=8)
+    hz_f32 = core.frequencies_softmax(
+        tf.cast(tf.cast(freqs, tf.bfloat16), tf.float32), depth=8)
+
+    self.assertEqual(tf.float32, hz_bf16.dtype)
+    self.assertAllClose(hz_f32, hz_bf16)
+
   def test_harmonic_to_sinusoidal_removes_nyquist_harmonics(self):
     f0_hz = np.asarray([50, 3001, 4001, 3001, 50])[np.newaxis, :, np.newaxis]
     orig_harm_amps = np.ones(shape=(1, 5, 3))
@@ -886,6 +920,48 @@ class FiniteImpulseResponseTest(parameterized.TestCase, tf.test.TestCase):
     audio_out_size = int(audio_out.shape[-1])
     self.assertEqual(audio_out_size, self.audio_size)
 
+  @parameterized.named_parameters(
+      ('no_frames', 513, 0),
+      ('single_frame', 513, 1),
+      ('non_divisible_frames', 65, 13),
+      ('many_frames', 65, 250),
+  )
+  def test_random_phase_noise_gives_correct_size(self, n_frequencies,
+                                                 n_frames):
+    """Tests synthesizing filtered noise in the frequency domain.
+
+    Args:
+      n_frequencies: Number of magnitudes.
+      n_frames: Number of frames for a time-varying filter.
+    """
+    if n_frames > 0:
+      magnitudes = np.random.uniform(size=(2, n_frames,
+                                           n_frequencies)).astype(np.float32)
+    else:
+      magnitudes = np.random.uniform(size=(2, n_frequencies)).astype(np.float32)
+
+    audio_out = core.random_phase_noise(magnitudes, self.audio_size)
+
+    self.assertAllEqual([2, self.audio_size], audio_out.shape.as_list())
+
+  def test_random_phase_noise_matches_white_noise_power(self):
+    """Flat unity magnitudes should give the power of uniform white noise."""
+    n_samples = 64000
+    magnitudes = np.ones((2, 250, 65), dtype=np.float32)
+
+    audio_out = core.random_phase_noise(magnitudes, n_samples)
+
+    self.assertNear(np.var(audio_out), 1.0 / 3.0, 0.02)
+
+  def test_random_phase_noise_has_zero_mean(self):
+    """DC should have a random sign, not a constant offset in every frame."""
+    n_samples = 64000
+    magnitudes = np.ones((2, 250, 65), dtype=np.float32)
+
+    audio_out = core.random_phase_noise(magnitudes, n_samples)
+
+    self.assertNear(np.mean(audio_out), 0.0, 0.01)
+
 
 if __name__ == '__main__':
   tf.test.main()
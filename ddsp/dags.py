@@ -90,7 +90,10 @@ class DAGLayer(tfkl.Layer):
         'name' are split off before adding modules.
     """
     keras_kwargs, kwarg_modules = split_keras_kwargs(kwarg_modules)
-    super().__init__(**keras_kwargs)
+    # The layer only routes tensors between modules. Keep it float32 under a
+    # mixed precision policy, so it doesn't cast inputs (such as f0_hz) down
+    # before they reach modules that compute in float32.
+    super().__init__(dtype='float32', **keras_kwargs)
 
     # Create properties/submodules from other kwargs.
     kwarg_modules = filter_by_value(kwarg_modules, is_module)
@@ -49,7 +49,10 @@ class Processor(tfkl.Layer):
   """
 
   def __init__(self, name: Text, trainable: bool = False):
-    super().__init__(name=name, trainable=trainable, autocast=False)
+    # Always float32, even under a mixed precision policy. Oscillator phases
+    # and long filters lose too much accuracy at lower precision.
+    super().__init__(name=name, trainable=trainable, autocast=False,
+                     dtype='float32')
 
   def call(self,
            *args: tf.Tensor,
@@ -57,9 +60,8 @@ class Processor(tfkl.Layer):
            **kwargs) -> tf.Tensor:
     """Convert input tensors arguments into a signal tensor."""
     # Don't use `training` or `mask` arguments from keras.Layer.
-    for k in ['training', 'mask']:
-      if k in kwargs:
-        _ = kwargs.pop(k)
+    kwargs.pop('training', None)
+    kwargs.pop('mask', None)
 
     controls = self.get_controls(*args, **kwargs)
     signal = self.get_signal(**controls)
@@ -159,6 +161,37 @@ class ProcessorGroup(dags.DAGLayer):
     return outputs['out']['signal']
 
 
+@gin.configurable
+class ParallelProcessorGroup(ProcessorGroup):
+  """ProcessorGroup that runs the whole DAG as a single traced graph.
+
+  Called eagerly, a ProcessorGroup runs its processors one after another from
+  Python. Independent processors, such as harmonic and noise synths that are
+  only summed at the end, have no data dependencies on each other. Tracing the
+  DAG into one tf.function lets the TF runtime dispatch those branches
+  concurrently instead of in sequence.
+  """
+
+  def get_controls(self, inputs: TensorDict, **kwargs) -> TensorDict:
+    """Run the traced DAG and get the outputs dictionary.
+
+    Args:
+      inputs: A dictionary of input tensors fed to the signal processing
+        processor_group.
+      **kwargs: Other kwargs for all the modules in the dag.
+
+    Returns:
+      A nested dictionary of all the output tensors.
+    """
+    self.built = True
+    return self.run_dag_graph(inputs, **kwargs)
+
+  @tf.function
+  def run_dag_graph(self, inputs: TensorDict, **kwargs) -> TensorDict:
+    """Run the DAG inside a tf.function."""
+    return self.run_dag(inputs, **kwargs)
+
+
 # Routing processors for manipulating signals in a processor_group -------------
 @gin.register
 class Add(Processor):
@@ -78,16 +78,49 @@ class ProcessorGroupTest(parameterized.TestCase, tf.test.TestCase):
       tensor = core.nested_lookup(tensor_string, outputs)
       self.assertIsInstance(tensor, (np.ndarray, tf.Tensor))
 
-  def test_dag_construction(self):
+  @parameterized.named_parameters(
+      ('sequential', processors.ProcessorGroup),
+      ('parallel', processors.ParallelProcessorGroup),
+  )
+  def test_dag_construction(self, group_class):
     """Tests if DAG is built properly and runs.
     """
-    processor_group = processors.ProcessorGroup(dag=self.dag,
-                                                name='processor_group')
+    processor_group = group_class(dag=self.dag, name='processor_group')
     outputs = processor_group.get_controls(self.nn_outputs)
     self.assertIsInstance(outputs, dict)
     self._check_tensor_outputs(self.expected_outputs, outputs)
 
 
+class MixedPrecisionTest(tf.test.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    self.addCleanup(tf.keras.mixed_precision.set_global_policy, 'float32')
+
+  def test_processor_group_keeps_controls_float32(self):
+    """Inputs should not be quantized to bfloat16 before reaching synths."""
+    harmonic = synths.Harmonic(n_samples=16000, name='harmonic')
+    processor_group = processors.ProcessorGroup(
+        dag=[(harmonic, ['amps', 'harmonic_distribution', 'f0_hz'])],
+        name='processor_group')
+    n_frames = 100
+    f0_hz = np.zeros((1, n_frames, 1), dtype=np.float32) + 441.3
+    inputs = {
+        'amps': np.ones((1, n_frames, 1), dtype=np.float32),
+        'harmonic_distribution': np.ones((1, n_frames, 10), dtype=np.float32),
+        'f0_hz': tf.constant(f0_hz),
+    }
+
+    outputs = processor_group(inputs, return_outputs_dict=True)
+
+    controls_f0_hz = core.nested_lookup('harmonic/controls/f0_hz',
+                                        outputs['controls'])
+    self.assertEqual(tf.float32, outputs['signal'].dtype)
+    self.assertEqual(tf.float32, controls_f0_hz.dtype)
+    self.assertAllEqual(f0_hz, controls_f0_hz)
+
+
 class AddTest(tf.test.TestCase):
 
   def test_output_is_correct(self):
@@ -77,6 +77,19 @@ def compute_mag(audio, size=2048, overlap=0.75, pad_end=True):
   mag = tf.abs(stft(audio, frame_size=size, overlap=overlap, pad_end=pad_end))
   return tf_float32(mag)
 
+
+@gin.register
+def compute_power_spectrogram(audio, size=2048, overlap=0.75, pad_end=True):
+  """Power spectrogram, |stft|^2, computed without a sqrt.
+
+  Equal to real(s * conj(s)). Cheaper than squaring compute_mag(), which takes
+  a sqrt only for it to be squared again.
+  """
+  s = stft(audio, frame_size=size, overlap=overlap, pad_end=pad_end)
+  power = tf.square(tf.math.real(s)) + tf.square(tf.math.imag(s))
+  return tf_float32(power)
+
+
 @gin.register
 def compute_mel(audio,
                 sample_rate=16000,
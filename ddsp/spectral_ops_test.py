@@ -55,6 +55,14 @@ class STFTTest(tf.test.TestCase):
     # TODO(jesseengel): The phase comes out a little different, figure out why.
     self.assertAllClose(np.abs(s_np), np.abs(s_tf), rtol=1e-3, atol=1e-3)
 
+  def test_power_spectrogram_is_squared_magnitude(self):
+    audio = np.random.rand(16000).astype(np.float32) * 2.0 - 1.0
+
+    power = spectral_ops.compute_power_spectrogram(audio, size=1024)
+    mag = spectral_ops.compute_mag(audio, size=1024)
+
+    self.assertAllClose(mag**2, power, rtol=1e-4, atol=1e-4)
+
 
 class DiffTest(tf.test.TestCase):
 
@@ -19,9 +19,28 @@ import math
 from ddsp import core
 from ddsp import processors
 import gin
+import numpy as np
 import tensorflow.compat.v2 as tf
 
 
+@tf.function(jit_compile=True)
+def _apply_scale_pair(scale_fn, a, b):
+  """Apply scale_fn to two tensors, compiled together by XLA.
+
+  Each tensor is scaled separately, so scale_fn need not be elementwise, but
+  XLA fuses both chains of ops into one computation.
+
+  Args:
+    scale_fn: Scaling function.
+    a: First tensor to scale.
+    b: Second tensor to scale.
+
+  Returns:
+    Tuple of (scale_fn(a), scale_fn(b)).
+  """
+  return scale_fn(a), scale_fn(b)
+
+
 @gin.register
 class TensorToAudio(processors.Processor):
   """Identity "synth" returning input samples with channel dimension removed."""
@@ -63,12 +82,41 @@ class Harmonic(processors.Processor):
                sample_rate=16000,
                scale_fn=core.exp_sigmoid,
                normalize_below_nyquist=True,
+               use_softmax_harmonic=False,
                name='harmonic'):
+    """Constructor.
+
+    Args:
+      n_samples: Number of audio samples to generate.
+      sample_rate: Samples per a second.
+      scale_fn: Scale function for amplitude and harmonic distribution inputs.
+      normalize_below_nyquist: Remove harmonics above the nyquist frequency
+        and normalize the remaining harmonic distribution to sum to 1.0.
+      use_softmax_harmonic: Get the harmonic distribution from a softmax over
+        the raw network outputs, instead of scale_fn followed by dividing by
+        the sum. The softmax is already normalized and numerically stable
+        (max-subtracted), so it replaces three passes (scale, sum, divide)
+        with a single fused op. Harmonics above nyquist are masked out of the
+        softmax, so no renormalization is needed. scale_fn is still applied
+        to the amplitudes.
+      name: Synth name.
+    """
     super().__init__(name=name)
     self.n_samples = n_samples
     self.sample_rate = sample_rate
     self.scale_fn = scale_fn
     self.normalize_below_nyquist = normalize_below_nyquist
+    self.use_softmax_harmonic = use_softmax_harmonic
+    # Harmonic numbers, cached per number of harmonics.
+    self._f_ratios = {}
+
+  def _get_harmonic_frequencies(self, f0_hz, n_harmonics):
+    """Harmonic frequencies, reusing the cached harmonic numbers."""
+    if n_harmonics not in self._f_ratios:
+      self._f_ratios[n_harmonics] = np.arange(
+          1, n_harmonics + 1, dtype=np.float32)
+    return core.get_harmonic_frequencies(
+        f0_hz, n_harmonics, f_ratios=self._f_ratios[n_harmonics])
 
   def get_controls(self,
                    amplitudes,
@@ -86,16 +134,21 @@ class Harmonic(processors.Processor):
     Returns:
       controls: Dictionary of tensors of synthesizer controls.
     """
+    if self.use_softmax_harmonic:
+      return self._get_softmax_controls(amplitudes, harmonic_distribution,
+                                        f0_hz)
+
     # Scale the amplitudes.
     if self.scale_fn is not None:
-      amplitudes = self.scale_fn(amplitudes)
-      harmonic_distribution = self.scale_fn(harmonic_distribution)
+      amplitudes, harmonic_distribution = _apply_scale_pair(
+          self.scale_fn, core.tf_float32(amplitudes),
+          core.tf_float32(harmonic_distribution))
 
     # Bandlimit the harmonic distribution.
     if self.normalize_below_nyquist:
       n_harmonics = int(harmonic_distribution.shape[-1])
-      harmonic_frequencies = core.get_harmonic_frequencies(f0_hz,
-                                                           n_harmonics)
+      harmonic_frequencies = self._get_harmonic_frequencies(f0_hz,
+                                                            n_harmonics)
       harmonic_distribution = core.remove_above_nyquist(harmonic_frequencies,
                                                         harmonic_distribution,
                                                         self.sample_rate)
@@ -109,6 +162,26 @@ class Harmonic(processors.Processor):
             'harmonic_distribution': harmonic_distribution,
             'f0_hz': f0_hz}
 
+  def _get_softmax_controls(self, amplitudes, harmonic_distribution, f0_hz):
+    """Controls with the harmonic distribution given by a (masked) softmax."""
+    if self.scale_fn is not None:
+      amplitudes = self.scale_fn(amplitudes)
+
+    if self.normalize_below_nyquist:
+      n_harmonics = int(harmonic_distribution.shape[-1])
+      harmonic_frequencies = self._get_harmonic_frequencies(f0_hz,
+                                                            n_harmonics)
+      harmonic_distribution = core.softmax_below_nyquist(
+          harmonic_frequencies, harmonic_distribution, self.sample_rate)
+    else:
+      harmonic_distribution = tf.nn.softmax(
+          core.tf_float32(harmonic_distribution), axis=-1)
+
+    return {'amplitudes': amplitudes,
+            'harmonic_distribution': harmonic_distribution,
+            'f0_hz': f0_hz}
+
+  @tf.function
   def get_signal(self, amplitudes, harmonic_distribution, f0_hz):
     """Synthesize audio with harmonic synthesizer from controls.
 
@@ -142,12 +215,32 @@ class FilteredNoise(processors.Processor):
                window_size=257,
                scale_fn=core.exp_sigmoid,
                initial_bias=-5.0,
+               random_phase=False,
+               seed=None,
                name='filtered_noise'):
+    """Constructor.
+
+    Args:
+      n_samples: Number of audio samples to generate.
+      window_size: Size of the window applied to the filter impulse response.
+      scale_fn: Scale function for the filter magnitudes.
+      initial_bias: Shift the filter magnitudes before scaling.
+      random_phase: Synthesize the noise directly in the frequency domain with
+        core.random_phase_noise(), a single inverse FFT per frame, instead of
+        filtering white noise by convolution. window_size is unused.
+      seed: Optional integer seed for the white noise, or for the random
+        phases if random_phase is True. If given, every call uses the same
+        noise, which makes rendering deterministic. Otherwise a new seed is
+        drawn each call.
+      name: Synth name.
+    """
     super().__init__(name=name)
     self.n_samples = n_samples
     self.window_size = window_size
     self.scale_fn = scale_fn
     self.initial_bias = initial_bias
+    self.random_phase = random_phase
+    self.seed = seed
 
   def get_controls(self, magnitudes):
     """Convert network outputs into a dictionary of synthesizer controls.
@@ -165,6 +258,7 @@ class FilteredNoise(processors.Processor):
 
     return {'magnitudes': magnitudes}
 
+  @tf.function
   def get_signal(self, magnitudes):
     """Synthesize audio with filtered white noise.
 
@@ -175,9 +269,19 @@ class FilteredNoise(processors.Processor):
     Returns:
       signal: A tensor of harmonic waves of shape [batch, n_samples, 1].
     """
-    batch_size = int(magnitudes.shape[0])
-    signal = tf.random.uniform(
-        [batch_size, self.n_samples], minval=-1.0, maxval=1.0)
+    # Only the 2-element seed comes from the stateful global generator, the
+    # noise itself is drawn statelessly.
+    if self.seed is None:
+      seed = tf.random.uniform([2], maxval=tf.int32.max, dtype=tf.int32)
+    else:
+      seed = [self.seed, 0]
+
+    if self.random_phase:
+      return core.random_phase_noise(magnitudes, self.n_samples, seed=seed)
+
+    batch_size = tf.shape(magnitudes)[0]
+    signal = tf.random.stateless_uniform(
+        [batch_size, self.n_samples], seed=seed, minval=-1.0, maxval=1.0)
     return core.frequency_filter(signal,
                                  magnitudes,
                                  window_size=self.window_size)
@@ -215,8 +319,9 @@ class Wavetable(processors.Processor):
     """
     # Scale the amplitudes.
     if self.scale_fn is not None:
-      amplitudes = self.scale_fn(amplitudes)
-      wavetables = self.scale_fn(wavetables)
+      amplitudes, wavetables = _apply_scale_pair(
+          self.scale_fn, core.tf_float32(amplitudes),
+          core.tf_float32(wavetables))
 
     return  {'amplitudes': amplitudes,
              'wavetables': wavetables,
@@ -279,18 +384,19 @@ class Sinusoidal(processors.Processor):
       controls: Dictionary of tensors of synthesizer controls.
     """
     # Scale the inputs.
-    if self.amp_scale_fn is not None:
-      amplitudes = self.amp_scale_fn(amplitudes)
-
     if self.freq_scale_fn is not None:
       frequencies = self.freq_scale_fn(frequencies, scale=self.freq_scale, hz_max=self.hz_max)
-      amplitudes = core.remove_above_nyquist(frequencies,
-                                             amplitudes,
-                                             self.sample_rate)
+      amplitudes = core.scaled_remove_above_nyquist(frequencies,
+                                                    amplitudes,
+                                                    self.sample_rate,
+                                                    scale_fn=self.amp_scale_fn)
+    elif self.amp_scale_fn is not None:
+      amplitudes = self.amp_scale_fn(amplitudes)
 
     return {'amplitudes': amplitudes,
             'frequencies': frequencies}
 
+  @tf.function
   def get_signal(self, amplitudes, frequencies):
     """Synthesize audio with sinusoidal synthesizer from controls.
 
@@ -328,6 +434,8 @@ class Impact(processors.Processor):
                initial_bias=-1.5,
                timing_adjust=True,
                include_noise=True,
+               sparse_impulses=True,
+               peak_chunk_size=64,
                name='impact'):
     super().__init__(name=name)
     self.n_samples = n_samples
@@ -339,6 +447,12 @@ class Impact(processors.Processor):
     self.initial_bias = initial_bias
     self.timing_adjust = timing_adjust
     self.include_noise = include_noise
+    self.sparse_impulses = sparse_impulses
+    self.peak_chunk_size = peak_chunk_size
+    # Time axis in seconds, shape [1, n_samples, 1]. Kept as a numpy array so
+    # it is embedded as a constant in whichever graph uses it.
+    t = np.arange(n_samples, dtype=np.float32) / sample_rate
+    self._t = t[np.newaxis, :, np.newaxis]
 
   def get_controls(self, magnitudes, stdevs, taus, tau_bias):
     """Convert network output tensors into a dictionary of synthesizer controls.
@@ -359,7 +473,7 @@ class Impact(processors.Processor):
     # Scale the inputs.
     if self.mag_scale_fn is not None:
       if self.include_noise:
-        noise = tf.abs(stdevs) * tf.random.normal(stdevs.shape, dtype=tf.float32)
+        noise = tf.abs(stdevs) * tf.random.normal(tf.shape(stdevs), dtype=tf.float32)
         magnitudes = self.mag_scale_fn(magnitudes + noise + self.initial_bias)
       else:
         magnitudes = self.mag_scale_fn(magnitudes + self.initial_bias)
@@ -369,18 +483,142 @@ class Impact(processors.Processor):
             'taus': taus}
 
 
+  @tf.function(jit_compile=True)
   def hertz_gaussian(self, peak_times, tau):
-    t = tf.reshape(tf.range(self.n_samples, dtype = tf.float32) / self.sample_rate, (1, -1, 1))
-    impulses =  tf.exp(-6/tf.square(tau) * tf.square(t - peak_times - tau / 2))
+    t = self._t
+    # Compute the tau terms on the small [batch, 1, n_peaks] tensors, before
+    # they are broadcast against the time axis.
+    inv_tau2_6 = 6.0 / tf.square(tau)
+    offset = peak_times + 0.5 * tau
+    impulses = tf.exp(-inv_tau2_6 * tf.square(t - offset))
     # impulses =  tf.exp(-6/tf.square(tau) * tf.square(t - peak_times))
     return impulses
 
+  @tf.function(jit_compile=True)
+  def sparse_hertz_gaussian(self, peak_times, tau, scale_heights):
+    """Sum of scaled gaussian impulses, evaluated only near each peak.
+
+    An impulse is negligible (< exp(-24)) further than 2 * max_tau from its
+    center, so instead of evaluating every impulse at every sample, evaluate
+    each one on a local window and scatter-add the windows into the signal.
+
+    Args:
+      peak_times: Impulse start times in seconds, of shape [batch, n_peaks].
+      tau: Impulse durations in seconds, of shape [batch, n_peaks].
+      scale_heights: Impulse heights, of shape [batch, n_peaks].
+
+    Returns:
+      signal: Sum of the scaled impulses, of shape [batch, n_samples].
+    """
+    half_width = int(math.ceil(2.0 * self.max_tau * self.sample_rate))
+    offsets = tf.range(-half_width, half_width + 1)
+
+    # Sample indices of a window around the center of each impulse.
+    centers = peak_times + 0.5 * tau
+    center_inds = tf.cast(tf.round(centers * self.sample_rate), tf.int32)
+    inds = center_inds[..., tf.newaxis] + offsets  # [batch, n_peaks, window]
+
+    t = tf.cast(inds, tf.float32) / self.sample_rate
+    inv_tau2_6 = 6.0 / tf.square(tau)
+    impulses = tf.exp(-inv_tau2_6[..., tf.newaxis] *
+                      tf.square(t - centers[..., tf.newaxis]))
+    impulses *= scale_heights[..., tf.newaxis]
+
+    # Drop the parts of windows that fall outside of the signal.
+    in_range = tf.logical_and(inds >= 0, inds < self.n_samples)
+    impulses = tf.where(in_range, impulses, tf.zeros_like(impulses))
+    inds = tf.clip_by_value(inds, 0, self.n_samples - 1)
+
+    # Overlapping windows are summed by scatter_nd.
+    batch_size = tf.shape(inds)[0]
+    batch_inds = tf.broadcast_to(
+        tf.range(batch_size)[:, tf.newaxis, tf.newaxis], tf.shape(inds))
+    scatter_inds = tf.stack([batch_inds, inds], axis=-1)
+    return tf.scatter_nd(scatter_inds, impulses,
+                         tf.stack([batch_size, self.n_samples]))
+
+  def dense_hertz_gaussian(self, peak_times, tau, scale_heights):
+    """Sum of scaled gaussian impulses, evaluated at every sample.
+
+    Peaks are processed peak_chunk_size at a time and accumulated, so memory
+    is O(n_samples * peak_chunk_size) instead of O(n_samples * n_peaks).
+
+    Args:
+      peak_times: Impulse start times in seconds, of shape [batch, n_peaks].
+      tau: Impulse durations in seconds, of shape [batch, n_peaks].
+      scale_heights: Impulse heights, of shape [batch, n_peaks].
+
+    Returns:
+      signal: Sum of the scaled impulses, of shape [batch, n_samples].
+    """
+    def scaled_impulses(peak_times, tau, scale_heights):
+      basis_impulses = self.hertz_gaussian(peak_times[:, tf.newaxis, :],
+                                           tau[:, tf.newaxis, :])
+      # Weighted sum over peaks without a [batch, n_samples, n_peaks] product.
+      return tf.einsum('bp,bsp->bs', scale_heights, basis_impulses)
+
+    n_peaks = int(peak_times.shape[-1])
+    chunk_size = self.peak_chunk_size
+    if not chunk_size or chunk_size >= n_peaks:
+      return scaled_impulses(peak_times, tau, scale_heights)
+
+    # Pad to a whole number of chunks. Padded peaks have zero height, and a
+    # nonzero tau to keep the gaussian finite.
+    n_chunks = int(math.ceil(n_peaks / chunk_size))
+    padding = [[0, 0], [0, n_chunks * chunk_size - n_peaks]]
+    peak_times = tf.pad(peak_times, padding)
+    tau = tf.pad(tau, padding, constant_values=self.max_tau)
+    scale_heights = tf.pad(scale_heights, padding)
+
+    # [batch, n_peaks] -> [n_chunks, batch, chunk_size].
+    to_chunks = lambda x: tf.transpose(
+        tf.reshape(x, [-1, n_chunks, chunk_size]), [1, 0, 2])
+    chunks = (to_chunks(peak_times), to_chunks(tau), to_chunks(scale_heights))
+
+    def add_chunk(signal, chunk):
+      return signal + scaled_impulses(*chunk)
+
+    batch_size = tf.shape(peak_times)[0]
+    initial_signal = tf.zeros(tf.stack([batch_size, self.n_samples]))
+    return tf.foldl(add_chunk, chunks, initializer=initial_signal)
+
   def hertz_sine(self, peak_times, tau):
-    t = tf.reshape(tf.range(self.n_samples, dtype = tf.float32) / self.sample_rate, (1, -1, 1))
+    t = self._t
     impulses =  tf.sin(math.pi*(t - peak_times) / tau)
     impulses = impulses * tf.cast(tf.logical_and(t >= peak_times, t <= (peak_times+tau)), tf.float32)
     return impulses
 
+  def pool_peaks(self, magnitude_envelopes):
+    """Find the largest magnitude in each window of the envelopes.
+
+    Windows are laid out like tf.nn.max_pool_with_argmax(padding='SAME'),
+    with padding // 2 samples of padding in front and the rest at the end.
+
+    Args:
+      magnitude_envelopes: Sample-wise magnitudes, of shape
+        [batch, n_samples].
+
+    Returns:
+      scale_heights: Largest magnitude in each window, of shape
+        [batch, n_windows].
+      inds: Sample index of each largest magnitude, of shape
+        [batch, n_windows].
+    """
+    window_size = int(self.sample_rate / self.max_impact_frequency)
+    n_windows = int(math.ceil(self.n_samples / window_size))
+    padding = n_windows * window_size - self.n_samples
+    pad_front = padding // 2
+    windows = tf.pad(magnitude_envelopes,
+                     [[0, 0], [pad_front, padding - pad_front]],
+                     constant_values=-np.inf)
+    windows = tf.reshape(windows, [-1, n_windows, window_size])
+    scale_heights = tf.reduce_max(windows, axis=-1)
+    inds = (tf.argmax(windows, axis=-1, output_type=tf.int32) +
+            tf.range(n_windows) * window_size - pad_front)
+    inds = tf.clip_by_value(inds, 0, self.n_samples - 1)
+    return scale_heights, inds
+
+  @tf.function
   def get_signal(self, magnitudes, taus):
     """Synthesize audio with sinusoidal synthesizer from controls.
 
@@ -408,27 +646,28 @@ class Impact(processors.Processor):
     taus = core.resample(taus, self.n_samples,
                           method=self.resample_method)
 
-    window_size = int(self.sample_rate / self.max_impact_frequency)
-    magnitude_envelopes = tf.expand_dims(magnitude_envelopes, axis=1)
-    vals, inds = tf.nn.max_pool_with_argmax(magnitude_envelopes, window_size, window_size, 'SAME')
+    # Take the largest magnitude in each window as the peak of an impact.
+    magnitude_envelopes = magnitude_envelopes[:, :, 0]
+    taus = taus[:, :, 0]
+    scale_heights, inds = self.pool_peaks(magnitude_envelopes)
+
     # Use a weighted average of magnitude to select peak time so that things can shift around
     if self.timing_adjust:
-      augmented_inds = tf.concat([inds - weight_distance, inds, inds + weight_distance], axis=-1)
+      augmented_inds = tf.stack([inds - weight_distance, inds, inds + weight_distance], axis=-1)
       augmented_inds = tf.clip_by_value(augmented_inds, 0, self.n_samples - 1)
-      b,w,h,c = magnitude_envelopes.get_shape().as_list()
-      mags_pooled = tf.gather(tf.reshape(magnitude_envelopes, shape=[b*w*h*c]), augmented_inds)
+      mags_pooled = tf.gather(magnitude_envelopes, augmented_inds, batch_dims=1)
       weighted_inds = tf.reduce_sum(tf.cast(augmented_inds, dtype=tf.float32) * mags_pooled, axis=-1) / tf.reduce_sum(mags_pooled, axis=-1)
-      peak_times = tf.cast(weighted_inds / self.sample_rate, dtype=tf.float32)
+      peak_times = weighted_inds / self.sample_rate
+    else:
+      peak_times = tf.cast(inds, dtype=tf.float32) / self.sample_rate
+
+    taus_pooled = tf.gather(taus, inds, batch_dims=1)
+    if self.sparse_impulses:
+      signal = self.sparse_hertz_gaussian(peak_times, taus_pooled,
+                                          scale_heights)
     else:
-      peak_times = tf.squeeze(tf.cast(inds / self.sample_rate, dtype=tf.float32), axis=3)
-    
-    scale_heights = tf.squeeze(vals, axis=3)
-    taus = tf.expand_dims(taus, axis=1)
-    b,w,h,c = taus.get_shape().as_list()
-    taus_pooled = tf.gather(tf.reshape(taus,shape= [b*w*h*c,]),inds)
-    taus_pooled = tf.squeeze(taus_pooled, axis=3)
-    basis_impulses = self.hertz_gaussian(peak_times, taus_pooled)
-    signal = tf.reduce_sum(scale_heights * basis_impulses, axis=2)
+      signal = self.dense_hertz_gaussian(peak_times, taus_pooled,
+                                         scale_heights)
     return signal
 
 @gin.register
@@ -454,6 +693,9 @@ class ModalFIR(processors.Processor):
     self.hz_max = hz_max
     self.freq_scale = freq_scale
     self.initial_bias = initial_bias
+    # Time axis in seconds, shape [n_samples, 1], as a numpy array.
+    t = np.arange(n_samples, dtype=np.float32) / sample_rate
+    self._t = t[:, np.newaxis]
 
   def get_controls(self, gains, frequencies, dampings):
     """Convert network output tensors into a dictionary of synthesizer controls.
@@ -470,9 +712,10 @@ class ModalFIR(processors.Processor):
       controls: Dictionary of tensors of synthesizer controls.
     """
     # Scale the inputs.
+    gains_scale_fn = None
     if self.amp_scale_fn is not None:
       # gains = 0.001 * self.amp_scale_fn(gains + self.initial_bias, exponent=3.0)
-      gains = tf.nn.softmax(gains)
+      gains_scale_fn = tf.nn.softmax
       # dampings = 10.0 / self.amp_scale_fn(4.0 * dampings + self.initial_bias)
       # dampings = 0.05 * self.freq_scale_fn(dampings, hz_min=0.0, hz_max=100000.0)
       dampings = 10000 * self.amp_scale_fn(dampings + self.initial_bias, exponent=4.0)
@@ -481,13 +724,15 @@ class ModalFIR(processors.Processor):
       if len(frequencies.shape) == 2:
         frequencies = tf.expand_dims(frequencies, axis=1)
       frequencies = self.freq_scale_fn(frequencies, hz_min=10.0, hz_max=self.hz_max, scale=self.freq_scale)
-    gains = core.remove_above_nyquist(frequencies,
-                                            gains,
-                                            self.sample_rate)
+    gains = core.scaled_remove_above_nyquist(frequencies,
+                                             gains,
+                                             self.sample_rate,
+                                             scale_fn=gains_scale_fn)
     return {'gains': gains,
             'frequencies': frequencies,
             'dampings': dampings}
 
+  @tf.function(jit_compile=True)
   def get_signal(self, gains, frequencies, dampings):
     """Synthesize audio with sinusoidal synthesizer from controls.
 
@@ -503,11 +748,13 @@ class ModalFIR(processors.Processor):
       signal: A tensor of exponentially decaying modal frequencies of shape [batch, n_samples].
     """
     # Create sample-wise envelopes.
-    t = tf.expand_dims(tf.cast(tf.range(self.n_samples)/self.sample_rate, dtype=tf.float32), axis=1)
-    amplitude_envelopes = gains * tf.exp(-dampings * t)
-    frequency_envelopes = frequencies * tf.ones_like(amplitude_envelopes)
+    amplitude_envelopes = gains * tf.exp(-dampings * self._t)
+    # Frequencies are constant in time, broadcast instead of multiplying ones.
+    frequency_envelopes = tf.broadcast_to(frequencies,
+                                          tf.shape(amplitude_envelopes))
     ir_half = core.oscillator_bank(frequency_envelopes=frequency_envelopes,
                                    amplitude_envelopes=amplitude_envelopes,
                                    sample_rate=self.sample_rate)
-    signal = tf.concat((tf.zeros_like(ir_half), ir_half), axis=1)
+    # Zero first half keeps the IR causal when used as a centered filter.
+    signal = tf.pad(ir_half, [[0, 0], [self.n_samples, 0]])
     return signal
\ No newline at end of file
@@ -15,6 +15,7 @@
 # Lint as: python3
 """Tests for ddsp.synths."""
 
+from absl.testing import parameterized
 from ddsp import core
 from ddsp import synths
 import numpy as np
@@ -40,8 +41,29 @@ class HarmonicTest(tf.test.TestCase):
 
     self.assertAllEqual([batch_size, 64000], output.shape.as_list())
 
+  def test_softmax_harmonic_distribution_is_normalized(self):
+    synthesizer = synths.Harmonic(
+        n_samples=16000,
+        sample_rate=16000,
+        use_softmax_harmonic=True)
+    batch_size = 3
+    num_frames = 100
+    amp = np.random.randn(batch_size, num_frames, 1).astype(np.float32)
+    harmonic_distribution = np.random.randn(
+        batch_size, num_frames, 16).astype(np.float32)
+    f0_hz = np.zeros((batch_size, num_frames, 1), dtype=np.float32) + 1000.0
+
+    controls = synthesizer.get_controls(amp, harmonic_distribution, f0_hz)
+    harmonic_distribution = controls['harmonic_distribution']
+
+    # Harmonics 8 and up are at or above nyquist.
+    self.assertAllClose(np.ones((batch_size, num_frames)),
+                        np.sum(harmonic_distribution, axis=-1))
+    self.assertAllEqual(np.zeros((batch_size, num_frames, 9)),
+                        harmonic_distribution[..., 7:])
 
-class FilteredNoiseTest(tf.test.TestCase):
+
+class FilteredNoiseTest(parameterized.TestCase, tf.test.TestCase):
 
   def test_output_shape_is_correct(self):
     synthesizer = synths.FilteredNoise(n_samples=16000)
@@ -50,6 +72,21 @@ class FilteredNoiseTest(tf.test.TestCase):
 
     self.assertAllEqual([3, 16000], output.shape.as_list())
 
+  @parameterized.named_parameters(
+      ('filtered', False),
+      ('random_phase', True),
+  )
+  def test_seeded_noise_is_deterministic(self, random_phase):
+    synthesizer = synths.FilteredNoise(n_samples=16000,
+                                       random_phase=random_phase,
+                                       seed=1234)
+    filter_bank_magnitudes = tf.zeros((3, 100, 65), dtype=tf.float32) + 3.0
+
+    output_1 = synthesizer(filter_bank_magnitudes)
+    output_2 = synthesizer(filter_bank_magnitudes)
+
+    self.assertAllEqual(output_1, output_2)
+
 
 class WavetableTest(tf.test.TestCase):
 
@@ -70,6 +107,18 @@ class WavetableTest(tf.test.TestCase):
 
     self.assertAllEqual([batch_size, 64000], output.shape.as_list())
 
+  def test_scale_fn_is_applied_to_each_control_separately(self):
+    synthesizer = synths.Wavetable(scale_fn=tf.nn.softmax)
+    amp = np.random.randn(3, 10, 1).astype(np.float32)
+    wavetables = np.random.randn(3, 10, 64).astype(np.float32)
+    f0_hz = np.zeros((3, 10, 1), dtype=np.float32) + 440
+
+    controls = synthesizer.get_controls(amp, wavetables, f0_hz)
+
+    # A non-elementwise scale_fn must not mix the two controls.
+    self.assertAllClose(tf.nn.softmax(amp), controls['amplitudes'])
+    self.assertAllClose(tf.nn.softmax(wavetables), controls['wavetables'])
+
 
 class SinusoidalTest(tf.test.TestCase):
 
@@ -111,5 +160,71 @@ class SinusoidalTest(tf.test.TestCase):
     self.assertTrue(np.all(both_conditions))
 
 
+class ImpactTest(tf.test.TestCase):
+
+  def _get_controls(self, synthesizer):
+    batch_size = 2
+    num_frames = 100
+    magnitudes = np.random.randn(batch_size, num_frames, 1).astype(np.float32)
+    stdevs = np.zeros((batch_size, num_frames, 1), dtype=np.float32)
+    taus = np.random.randn(batch_size, num_frames, 1).astype(np.float32)
+    tau_bias = np.zeros((batch_size, 1, 1), dtype=np.float32)
+    return synthesizer.get_controls(magnitudes, stdevs, taus, tau_bias)
+
+  def test_output_shape_is_correct(self):
+    synthesizer = synths.Impact(n_samples=16000, sample_rate=16000)
+    controls = self._get_controls(synthesizer)
+
+    output = synthesizer.get_signal(**controls)
+
+    self.assertAllEqual([2, 16000], output.shape.as_list())
+
+  def test_pooled_peaks_match_max_pool(self):
+    synthesizer = synths.Impact(n_samples=16000, sample_rate=16000)
+    magnitude_envelopes = np.random.rand(2, 16000).astype(np.float32)
+
+    scale_heights, inds = synthesizer.pool_peaks(magnitude_envelopes)
+
+    window_size = int(16000 / synthesizer.max_impact_frequency)
+    vals, max_pool_inds = tf.nn.max_pool_with_argmax(
+        magnitude_envelopes[:, tf.newaxis, :, tf.newaxis],
+        window_size, window_size, 'SAME')
+    self.assertAllEqual(vals[:, 0, :, 0], scale_heights)
+    self.assertAllEqual(max_pool_inds[:, 0, :, 0], inds)
+
+  def test_sparse_impulses_match_dense(self):
+    make_synth = lambda sparse: synths.Impact(n_samples=16000,
+                                              sample_rate=16000,
+                                              include_noise=False,
+                                              sparse_impulses=sparse)
+    sparse_synthesizer = make_synth(True)
+    dense_synthesizer = make_synth(False)
+    controls = self._get_controls(sparse_synthesizer)
+
+    sparse = sparse_synthesizer.get_signal(**controls)
+    dense = dense_synthesizer.get_signal(**controls)
+
+    # The impulses are steep, so float32 rounding of the sample times is
+    # amplified. Compare relative to the peak height.
+    peak = np.max(np.abs(dense))
+    self.assertAllClose(dense / peak, sparse / peak, atol=1e-3)
+
+  def test_chunked_dense_impulses_match_unchunked(self):
+    make_synth = lambda chunk_size: synths.Impact(n_samples=16000,
+                                                  sample_rate=16000,
+                                                  include_noise=False,
+                                                  sparse_impulses=False,
+                                                  peak_chunk_size=chunk_size)
+    # 31 peaks, so chunks of 8 include some padding.
+    chunked_synthesizer = make_synth(8)
+    unchunked_synthesizer = make_synth(None)
+    controls = self._get_controls(chunked_synthesizer)
+
+    chunked = chunked_synthesizer.get_signal(**controls)
+    unchunked = unchunked_synthesizer.get_signal(**controls)
+
+    self.assertAllClose(unchunked, chunked, atol=1e-5)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -99,6 +99,10 @@ flags.DEFINE_boolean('hypertune', False,
 flags.DEFINE_float('early_stop_loss_value', None,
                    'Stops training early when the `total_loss` reaches below '
                    'this value during training.')
+flags.DEFINE_enum('precision_policy', 'float32', ['float32', 'mixed_bfloat16'],
+                  'Keras dtype policy for the networks. With mixed_bfloat16 '
+                  'layers compute in bfloat16 and keep float32 variables. '
+                  'Processors (synths and effects) always run in float32.')
 
 # Gin config flags.
 flags.DEFINE_multi_string('gin_search_path', [],
@@ -183,6 +187,10 @@ def main(unused_argv):
   if FLAGS.allow_memory_growth:
     allow_memory_growth()
 
+  if FLAGS.precision_policy != 'float32':
+    logging.info('Using precision policy: %s', FLAGS.precision_policy)
+    tf.keras.mixed_precision.set_global_policy(FLAGS.precision_policy)
+
   # Training.
   if FLAGS.mode == 'train':
     strategy = train_util.get_strategy(tpu=FLAGS.tpu,
@@ -36,13 +36,20 @@ class RnnFcDecoder(nn.OutputSplitsLayer):
                input_keys=('ld_scaled', 'f0_scaled', 'z'),
                output_splits=(('amps', 1), ('harmonic_distribution', 40)),
                upsampling=None,
+               fuse_input_stacks=False,
                **kwargs):
     super().__init__(
         input_keys=input_keys, output_splits=output_splits, **kwargs)
     stack = lambda: nn.FcStack(ch, layers_per_stack)
 
     # Layers.
-    self.input_stacks = [stack() for k in self.input_keys]
+    # Fused input stacks keep separate weights per input, but run all of them
+    # as a single grouped matmul per layer.
+    self.fuse_input_stacks = fuse_input_stacks
+    if self.fuse_input_stacks:
+      self.input_stacks = nn.GroupedFcStack(ch, layers_per_stack)
+    else:
+      self.input_stacks = [stack() for k in self.input_keys]
     self.rnn = nn.Rnn(rnn_channels, rnn_type)
     self.out_stack = stack()
     if upsampling:
@@ -52,14 +59,18 @@ class RnnFcDecoder(nn.OutputSplitsLayer):
 
   def compute_output(self, *inputs):
     # Initial processing.
-    inputs = [stack(x) for stack, x in zip(self.input_stacks, inputs)]
+    if self.fuse_input_stacks:
+      concat_in = self.input_stacks(list(inputs))
+    else:
+      inputs = [stack(x) for stack, x in zip(self.input_stacks, inputs)]
+      concat_in = tf.concat(inputs, axis=-1)
 
-    # Run an RNN over the latents.
-    x = tf.concat(inputs, axis=-1)
+    # Run an RNN over the latents, reusing the concatenated inputs for the
+    # skip connection.
     if self.upsample:
-      x = self.upsample(x)
-    x = self.rnn(x)
-    x = tf.concat(inputs + [x], axis=-1)
+      concat_in = self.upsample(concat_in)
+    x = self.rnn(concat_in)
+    x = tf.concat([concat_in, x], axis=-1)
 
     # Final processing.
     return self.out_stack(x)
@@ -110,17 +121,55 @@ class MultiDecoder(tfkl.Layer):
 
   def __init__(self,
                decoder_list,
+               in_place_update=False,
                **kwargs):
+    """Constructor.
+
+    Args:
+      decoder_list: List of decoders to run in order.
+      in_place_update: Write decoder outputs directly into the input
+        dictionary, instead of a copy of it. Only safe if the caller does not
+        reuse the input dictionary after this layer.
+      **kwargs: Other keras layer kwargs such as name.
+    """
     super().__init__(**kwargs)
     self.decoder_list = decoder_list
+    self.in_place_update = in_place_update
 
-  def call(self, inputs):
+  def call(self, inputs, training=None):
     """Updates conditioning with dictionary of decoder outputs."""
-    conditioning = ddsp.core.copy_if_tf_function(inputs)
+    if self.in_place_update:
+      conditioning = inputs
+    else:
+      conditioning = ddsp.core.copy_if_tf_function(inputs)
+    conditioning.update(self.decode_all(conditioning, training=training))
+    return conditioning
+
+  @tf.function
+  def decode_all(self, conditioning, training=None):
+    """Run all decoders as a single graph, return their combined outputs.
+
+    Tracing the loop lets sub-decoders that don't depend on each other have
+    their kernels scheduled back-to-back (or concurrently) by the runtime
+    instead of being dispatched one at a time from python.
+
+    Args:
+      conditioning: Dictionary of input tensors for the decoders.
+      training: Training mode passed to each decoder. Passed explicitly so
+        that it is part of the tf.function trace key, rather than read from
+        the keras call context when the function is first traced.
+
+    Returns:
+      Dictionary of all decoder outputs. Each decoder also sees the outputs of
+      the decoders before it.
+    """
+    conditioning = dict(conditioning)
+    outputs = {}
     for dec in self.decoder_list:
-      x = dec(conditioning)
+      x = dec(conditioning, training=training)
       if isinstance(x, dict):
         conditioning.update(x)
+        outputs.update(x)
       else:
         raise ValueError('Encoder must output a dictionary of signals.')
-    return conditioning
\ No newline at end of file
+    return outputs
\ No newline at end of file
@@ -15,8 +15,38 @@
 # Lint as: python3
 """Tests for ddsp.training.decoders."""
 
+from ddsp.training import decoders
+from ddsp.training import nn
+import numpy as np
 import tensorflow.compat.v2 as tf
 
+tfkl = tf.keras.layers
+
+
+class DropoutDecoder(nn.DictLayer):
+  """Decoder whose output depends on the training mode."""
+
+  def __init__(self):
+    super().__init__(input_keys=('x',), output_keys=('y',))
+    self.dropout = tfkl.Dropout(0.5)
+
+  def call(self, x, training=None):
+    return self.dropout(x, training=training)
+
+
+class MultiDecoderTest(tf.test.TestCase):
+
+  def test_training_mode_is_not_baked_into_trace(self):
+    decoder = decoders.MultiDecoder([DropoutDecoder()])
+    x = np.ones((2, 100), dtype=np.float32)
+
+    # Run both modes twice, in both orders.
+    for training in (True, False, True, False):
+      y = decoder({'x': x}, training=training)['y']
+      if training:
+        self.assertIn(0.0, y.numpy())
+      else:
+        self.assertAllEqual(x, y)
 
 
 if __name__ == '__main__':
@@ -15,15 +15,36 @@
 # Lint as: python3
 """Library of encoder objects."""
 
+import functools
+
 import ddsp
 from ddsp import spectral_ops
 from ddsp.training import nn
 import gin
+import numpy as np
 import tensorflow.compat.v2 as tf
 
 tfkl = tf.keras.layers
 
 
+@functools.lru_cache(maxsize=None)
+def _linear_resample_matrix(n_in, n_out):
+  """Matrix [n_out, n_in] of ddsp.core.resample(method='linear') weights.
+
+  Matches tf.compat.v1.image.resize bilinear with align_corners=False, so
+  `matrix @ z` along time equals resample(z, n_out). The weights only depend on
+  the two lengths, so they are built once per pair and reused.
+  """
+  src = np.arange(n_out) * (n_in / n_out)
+  i0 = np.minimum(np.floor(src).astype(np.int64), n_in - 1)
+  i1 = np.minimum(i0 + 1, n_in - 1)
+  frac = (src - i0).astype(np.float32)
+  matrix = np.zeros([n_out, n_in], dtype=np.float32)
+  np.add.at(matrix, (np.arange(n_out), i0), 1.0 - frac)
+  np.add.at(matrix, (np.arange(n_out), i1), frac)
+  return matrix
+
+
 # ------------------ Encoders --------------------------------------------------
 class ZEncoder(nn.DictLayer):
   """Base class to implement an encoder that creates a latent z vector.
@@ -31,6 +52,8 @@ class ZEncoder(nn.DictLayer):
   Users should override compute_z() to define the actual encoder structure.
   Input_keys from compute_z() instead of call(), output_keys are always ['z'].
   """
+  # Subclasses set this to expand z to a fixed number of time steps.
+  z_time_steps = None
 
   def __init__(self, input_keys=None, other_encoders=None, **kwargs):
     """Constructor."""
@@ -42,26 +65,22 @@ class ZEncoder(nn.DictLayer):
       for enc in self.other_encoders:
         input_keys.append(enc.input_key)
     super().__init__(input_keys, output_keys=['z'], **kwargs)
+    # Resolved once here, rather than on every call.
+    self._n_other_encoders = len(other_encoders) if other_encoders else 0
 
   def call(self, *args, **unused_kwargs):
     """Takes in input tensors and returns a latent tensor z."""
-    time_steps = None
+    time_steps = self.z_time_steps
     if 'f0_scaled' in unused_kwargs:
       time_steps = int(unused_kwargs['f0_scaled'].shape[1])
-    elif hasattr(self, 'z_time_steps'):
-      time_steps = self.z_time_steps
-
-    # inputs = args[:-1]  # Last input just used for time_steps.
-    if self.other_encoders:
-      inputs = args[:-len(self.other_encoders)]
-    else:
-      inputs = args
+
+    # The last inputs are for the other encoders.
+    inputs = args[:len(args) - self._n_other_encoders]
     z = self.compute_z(*inputs)
     if time_steps:
       z = self.expand_z(z, time_steps)
-    if self.other_encoders:
-      for i, enc in enumerate(reversed(self.other_encoders)):
-        z = self.concat_encoding(enc.compute_encoding(args[-(i+1)]), z)
+    for i, enc in enumerate(reversed(self.other_encoders or [])):
+      z = self.concat_encoding(enc.compute_encoding(args[-(i+1)]), z)
     return z
 
   def concat_encoding (self, enc, z):
@@ -76,7 +95,8 @@ class ZEncoder(nn.DictLayer):
     # Expand time dim of z if necessary.
     z_time_steps = int(z.shape[1])
     if z_time_steps != time_steps:
-      z = ddsp.core.resample(z, time_steps)
+      matrix = _linear_resample_matrix(z_time_steps, int(time_steps))
+      z = tf.einsum('ot,btc->boc', matrix, ddsp.core.tf_float32(z))
     return z
 
   def compute_z(self, *inputs):
@@ -97,8 +117,15 @@ class MfccTimeDistributedRnnEncoder(ZEncoder):
                sample_rate=16000,
                other_encoders=None,
                tcnn_kernel=7,
+               time_reduction=1,
                **kwargs):
     super().__init__(other_encoders=other_encoders, **kwargs)
+    # Stack this many adjacent MFCC frames into one step before the RNN, to
+    # cut the number of recurrent steps. expand_z() restores the time steps.
+    self.time_reduction = time_reduction
+    if time_reduction > 1 and not z_time_steps:
+      raise ValueError('`z_time_steps` must be set when `time_reduction` > 1, '
+                       'so that expand_z() can restore the time steps.')
     if mfcc_time_steps not in [63, 125, 250, 500, 1000]:
       raise ValueError(
           '`mfcc_time_steps` currently limited to 63,125,250,500 and 1000')
@@ -131,26 +158,54 @@ class MfccTimeDistributedRnnEncoder(ZEncoder):
       print('Z time steps: %i'%z_time_steps)
       self.z_time_steps = z_time_steps
 
+    # MFCC projections are fixed, so build them once instead of every call.
+    # Same as spectral_ops.compute_mfcc() with 128 mel bins and 40 mfccs. Kept
+    # as numpy arrays, so XLA folds them in as constants.
+    with tf.init_scope():
+      self._mel_w = tf.signal.linear_to_mel_weight_matrix(
+          num_mel_bins=128,
+          num_spectrogram_bins=self.fft_size // 2 + 1,
+          sample_rate=self.sample_rate,
+          lower_edge_hertz=4.0,
+          upper_edge_hertz=16000.0).numpy()
+    # DCT-II basis, scaled as in tf.signal.mfccs_from_log_mel_spectrograms().
+    n_mel, n_mfcc = np.arange(128)[:, np.newaxis], np.arange(40)[np.newaxis, :]
+    self._dct = (2.0 * np.cos(np.pi * n_mfcc * (2 * n_mel + 1) / (2 * 128)) /
+                 np.sqrt(2.0 * 128)).astype(np.float32)
+    # Periodic hann window, same as the tf.signal.stft() default.
+    n = np.arange(self.fft_size, dtype=np.float32)
+    self._window = 0.5 - 0.5 * np.cos(2.0 * np.pi * n / self.fft_size)
+
     # Layers.
     self.z_norm = nn.Normalize('instance')
     self.rnn = nn.Rnn(rnn_channels, rnn_type)
     self.tcnn = nn.temporal_cnn(rnn_channels, tcnn_kernel, causal=False)
     self.dense_out = tfkl.Dense(z_dims)
 
-  def compute_z(self, audio):
-    mfccs = spectral_ops.compute_mfcc(
+  @tf.function(jit_compile=True)
+  def compute_features(self, audio):
+    """Normalized MFCCs, compiled by XLA into a single fused computation."""
+    audio = ddsp.core.tf_float32(audio)
+    if len(audio.shape) == 3:
+      audio = audio[:, :, 0]
+    stft = tf.signal.stft(
         audio,
-        sample_rate=self.sample_rate,
-        lo_hz=4.0,
-        hi_hz=16000.0,
-        fft_size=self.fft_size,
-        mel_bins=128,
-        mfcc_bins=40,
-        overlap=self.overlap,
+        frame_length=self.fft_size,
+        frame_step=int(self.fft_size * (1.0 - self.overlap)),
+        fft_length=self.fft_size,
+        window_fn=lambda length, dtype: tf.cast(self._window, dtype),
         pad_end=True)
+    mel = tf.tensordot(tf.abs(stft), self._mel_w, 1)
+    mfccs = tf.tensordot(ddsp.core.safe_log(mel), self._dct, 1)
 
     # Normalize.
-    z = self.z_norm(mfccs[:, :, tf.newaxis, :])[:, :, 0, :]
+    return self.z_norm(mfccs)
+
+  def compute_z(self, audio):
+    # The RNN is left out of the XLA cluster so it can use the cuDNN kernels.
+    z = self.compute_features(audio)
+    if self.time_reduction > 1:
+      z = self.reduce_time(z)
     # Run an RNN over the latents.
     z = self.rnn(z)
     # Run a tcnn over latents.
@@ -159,6 +214,17 @@ class MfccTimeDistributedRnnEncoder(ZEncoder):
     z = self.dense_out(z)
     return z
 
+  def reduce_time(self, z):
+    """Concatenate groups of time_reduction frames, [B, T, C] -> [B, T/N, N*C].
+
+    The end is zero-padded if T is not a multiple of time_reduction.
+    """
+    n = self.time_reduction
+    n_frames, n_channels = int(z.shape[1]), int(z.shape[2])
+    n_steps = -(-n_frames // n)
+    z = tf.pad(z, [[0, 0], [0, n_steps * n - n_frames], [0, 0]])
+    return tf.reshape(z, [-1, n_steps, n * n_channels])
+
 class ContextEncoder(tfkl.Layer):
   """Mixin for context encoders."""
 
@@ -190,7 +256,9 @@ class EmbeddingContextEncoder(ContextEncoder):
 
   def compute_encoding(self, inputs):
     """Compute context from embedding."""
-    return self.embedding(tf.cast(inputs, dtype=tf.int32))
+    # Embedding looks up int32 and int64 ids directly, and only casts other
+    # dtypes itself, so there's no need to copy the ids with a cast here.
+    return self.embedding(inputs)
 
   def call(self, conditioning):
     """Updates conditioning with embedding."""
@@ -205,16 +273,42 @@ class MultiEncoder(tfkl.Layer):
     super().__init__(**kwargs)
     self.encoder_list = encoder_list
 
-  def call(self, inputs):
+  def call(self, inputs, training=None):
     """Updates conditioning with dictionary of encoder outputs."""
     conditioning = ddsp.core.copy_if_tf_function(inputs)
+    conditioning.update(self.encode_all(conditioning, training=training))
+    return conditioning
+
+  @tf.function
+  def encode_all(self, conditioning, training=None):
+    """Run all encoders as a single graph, return their combined outputs.
+
+    Same as MultiDecoder.decode_all(): tracing the chain inlines every
+    encoder into one graph, so they are not dispatched one at a time from
+    python.
+
+    Args:
+      conditioning: Dictionary of input tensors for the encoders.
+      training: Training mode passed to each encoder, so that it is part of
+        the trace key (e.g. for batch norm in the video backbone).
+
+    Returns:
+      Dictionary of all encoder outputs. Each encoder also sees the outputs of
+      the encoders before it.
+
+    Raises:
+      ValueError: If an encoder does not output a dictionary.
+    """
+    conditioning = dict(conditioning)
+    outputs = {}
     for enc in self.encoder_list:
-      x = enc(conditioning)
+      x = enc(conditioning, training=training)
       if isinstance(x, dict):
         conditioning.update(x)
+        outputs.update(x)
       else:
         raise ValueError('Encoder must output a dictionary of signals.')
-    return conditioning
+    return outputs
 
 # Transcribing Autoencoder Encoders --------------------------------------------
 @gin.register
@@ -239,12 +333,11 @@ class ResnetSinusoidalEncoder(nn.DictLayer):
 
     # Layers.
     self.resnet = nn.ResNet(size=size)
-    self.dense_outs = [tfkl.Dense(v[1]) for v in output_splits]
+    # One projection for all outputs, split afterwards.
+    self.dense_out = tfkl.Dense(sum([v[1] for v in output_splits]))
 
   def call(self, audio):
     """Updates conditioning with z and (optionally) f0."""
-    outputs = {}
-
     # [batch, 64000, 1]
     mag = self.spectral_fn(audio)
 
@@ -254,13 +347,11 @@ class ResnetSinusoidalEncoder(nn.DictLayer):
 
     # [batch, 125, 8, 1024]
     # # Collapse the frequency dimension.
-    x = tf.reshape(x, [int(x.shape[0]), int(x.shape[1]), -1])
+    n_time, n_freq, n_ch = [int(d) for d in x.shape[1:]]
+    x = tf.reshape(x, [-1, n_time, n_freq * n_ch])
 
     # [batch, 125, 8192]
-    for layer, key in zip(self.dense_outs, self.output_keys):
-      outputs[key] = layer(x)
-
-    return outputs
+    return nn.split_to_dict(self.dense_out(x), self.output_splits)
 
 
 @gin.register
@@ -280,19 +371,37 @@ class SinusoidalToHarmonicEncoder(nn.DictLayer):
                    x, depth=64, hz_min=20.0, hz_max=1200.0),
                # pylint: enable=g-long-lambda
                sample_rate=16000,
+               use_softmax_harmonic=False,
                **kwargs):
-    """Constructor."""
+    """Constructor.
+
+    Args:
+      net: Network applied to the concatenated sinusoidal controls.
+      n_harmonics: Number of harmonics in the output distribution.
+      f0_depth: Number of softmax bins for the f0 prediction.
+      amp_scale_fn: Scale function for amplitude and harmonic distribution.
+      freq_scale_fn: Scale function for f0.
+      sample_rate: Sample rate, used to remove harmonics above nyquist.
+      use_softmax_harmonic: Get the harmonic distribution from a softmax over
+        the logits, with harmonics above nyquist masked out, instead of
+        scaling with amp_scale_fn and renormalizing. Same as the option on
+        synths.Harmonic.
+      **kwargs: Other keras layer kwargs such as name.
+    """
     super().__init__(**kwargs)
     self.n_harmonics = n_harmonics
     self.amp_scale_fn = amp_scale_fn
     self.freq_scale_fn = freq_scale_fn
     self.sample_rate = sample_rate
+    self.use_softmax_harmonic = use_softmax_harmonic
+    # Harmonic numbers [1, ..., n_harmonics], fixed at construction.
+    self._harm_idx = np.arange(1, n_harmonics + 1, dtype=np.float32)
 
     # Layers.
     self.net = net
-    self.amp_out = tfkl.Dense(1)
-    self.hd_out = tfkl.Dense(n_harmonics)
-    self.f0_out = tfkl.Dense(f0_depth)
+    # One projection for amplitude, harmonic distribution and f0, split after.
+    self.head_sizes = [1, n_harmonics, f0_depth]
+    self.dense_out = tfkl.Dense(sum(self.head_sizes))
 
   def call(self, sin_freqs, sin_amps) -> ['harm_amp', 'harm_dist', 'f0_hz']:
     """Converts (sin_freqs, sin_amps) to (f0, amp, hd).
@@ -321,51 +430,132 @@ class SinusoidalToHarmonicEncoder(nn.DictLayer):
     x = x['out'] if isinstance(x, dict) else x
 
     # Output layers.
-    harm_amp = self.amp_out(x)
-    harm_dist = self.hd_out(x)
-    f0 = self.f0_out(x)
+    harm_amp, harm_dist, f0 = tf.split(self.dense_out(x), self.head_sizes,
+                                       axis=-1)
 
     # Output scaling.
     harm_amp = self.amp_scale_fn(harm_amp)
-    harm_dist = self.amp_scale_fn(harm_dist)
     f0_hz = self.freq_scale_fn(f0)
+    harm_dist = self._finalize_harmonics(harm_dist, f0_hz)
+
+    return (harm_amp, harm_dist, f0_hz)
+
+  @tf.function(jit_compile=True)
+  def _finalize_harmonics(self, harm_dist, f0_hz):
+    """Scale, bandlimit and normalize the harmonic distribution.
+
+    Compiled with XLA so the masking and normalization fuse into a single pass
+    over the [batch, time, n_harmonics] tensor.
+
+    Args:
+      harm_dist: Harmonic distribution logits, of shape
+        [batch, time, n_harmonics].
+      f0_hz: Fundamental frequency in Hertz, of shape [batch, time, 1].
+
+    Returns:
+      Normalized harmonic distribution, of shape [batch, time, n_harmonics].
+    """
+    harm_freqs = ddsp.core.get_harmonic_frequencies(
+        f0_hz, self.n_harmonics, f_ratios=self._harm_idx)
+
+    if self.use_softmax_harmonic:
+      return ddsp.core.softmax_below_nyquist(harm_freqs, harm_dist,
+                                             self.sample_rate)
 
     # Filter harmonic distribution for nyquist.
-    harm_freqs = ddsp.core.get_harmonic_frequencies(f0_hz, self.n_harmonics)
-    harm_dist = ddsp.core.remove_above_nyquist(harm_freqs,
-                                               harm_dist,
-                                               self.sample_rate)
-    harm_dist = ddsp.core.safe_divide(
+    harm_dist = ddsp.core.scaled_remove_above_nyquist(harm_freqs,
+                                                      harm_dist,
+                                                      self.sample_rate,
+                                                      self.amp_scale_fn)
+    return ddsp.core.safe_divide(
         harm_dist, tf.reduce_sum(harm_dist, axis=-1, keepdims=True))
 
-    return (harm_amp, harm_dist, f0_hz)
-
 @gin.register
 class VideoEncoder(ZEncoder):
   """Generate latent variables with deep features from a video network."""
 
+  # Keras application name, and name prefixes of the layers left trainable
+  # by freeze_backbone (the last block and the final layers).
+  backbones = {
+      'resnet50v2': ('ResNet50V2', ('conv5_block3', 'post_')),
+      'mobilenetv3small': ('MobileNetV3Small', ('expanded_conv_10', 'Conv_1')),
+  }
+
   def __init__(self,
                rnn_channels=512,
                rnn_type='gru',
                z_dims=32,
                z_time_steps=250,
                other_encoders=None,
+               mixed_precision=False,
+               backbone='resnet50v2',
+               freeze_backbone=False,
+               quantize_backbone=False,
                **kwargs):
+    """Constructor.
+
+    Args:
+      rnn_channels: Channels of the temporal convolution over frame features.
+      rnn_type: Unused, kept for config compatibility.
+      z_dims: Dimensions of the output latent z.
+      z_time_steps: Number of time steps of the output latent z.
+      other_encoders: Optional list of context encoders to concatenate to z.
+      mixed_precision: Run the vision network under a mixed_bfloat16 policy.
+        The ResNet is compute bound at this resolution, so bfloat16 roughly
+        doubles its throughput on TPUs and GPUs with bfloat16 tensor cores.
+        bfloat16 has the exponent range of float32, so gradients through a
+        trainable backbone don't underflow without loss scaling (which the
+        trainers don't apply). Its features are cast back to float32 before
+        the rest of the encoder.
+      backbone: Pretrained vision network, one of 'resnet50v2' or
+        'mobilenetv3small'. MobileNetV3Small needs several times fewer FLOPs
+        per frame, and rescales raw [0, 255] frames itself.
+      freeze_backbone: Only fine tune the last block of the vision network.
+        The frozen layers need no gradients or optimizer state, and their
+        batch norms run in inference mode.
+      quantize_backbone: Wrap the vision network for int8 quantization aware
+        training with the TF Model Optimization Toolkit, so it can later be
+        exported to an int8 TFLite/TensorRT model with little accuracy loss.
+        Requires `pip install ddsp[quantization]`, and can't be combined with
+        mixed_precision.
+      **kwargs: Other keras layer kwargs such as name.
+    """
     super().__init__(other_encoders=other_encoders, **kwargs)
+    if backbone not in self.backbones:
+      raise ValueError(f'backbone ({backbone}) must be one of '
+                       f'{list(self.backbones.keys())}')
+    if quantize_backbone and mixed_precision:
+      raise ValueError('quantize_backbone and mixed_precision can not both be '
+                       'True.')
     self.z_time_steps = z_time_steps
+    self.mixed_precision = mixed_precision
+    self.backbone = backbone
+    self.freeze_backbone = freeze_backbone
+    self.quantize_backbone = quantize_backbone
 
     # Layers.
     self.z_norm = nn.Normalize('instance')
     self.rnn = nn.temporal_cnn(rnn_channels, 10)
-    self.dense_out = nn.dense(z_dims)
+    self.dense_out = tfkl.Dense(z_dims)
     self.frame_shape = (360, 640, 3)
-    self.cv_net = tf.keras.applications.ResNet50V2(include_top=False, weights='imagenet', input_shape=self.frame_shape, pooling=None)
-    #TODO(sclarke): Change this for fine tuning
+    global_policy = tf.keras.mixed_precision.global_policy()
+    if self.mixed_precision:
+      tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+    net_name, trainable_prefixes = self.backbones[backbone]
+    try:
+      self.cv_net = getattr(tf.keras.applications, net_name)(include_top=False, weights='imagenet', input_shape=self.frame_shape, pooling=None)
+    finally:
+      tf.keras.mixed_precision.set_global_policy(global_policy)
     self.cv_net.trainable = True
     print('Vision network layer count: %i'%len(self.cv_net.layers))
-    # for l in self.cv_net.layers:
-    #   if not('block7' in l.name or 'top' in l.name):
-    #     l.trainable = False
+    if self.freeze_backbone:
+      for l in self.cv_net.layers:
+        if not l.name.startswith(trainable_prefixes):
+          l.trainable = False
+    if self.quantize_backbone:
+      # Optional dependency, only imported when used.
+      import tensorflow_model_optimization as tfmot  # pylint: disable=g-import-not-at-top
+      self.cv_net = tfmot.quantization.keras.quantize_model(self.cv_net)
     self.final_layers = tf.keras.Sequential(layers=[
                           tf.keras.layers.GlobalAveragePooling2D(),
                         ])
@@ -373,11 +563,13 @@ class VideoEncoder(ZEncoder):
   def compute_z(self, frames):
     batch_flat = tf.reshape(frames, (-1,) + self.frame_shape)
     image_features = self.cv_net(batch_flat)
-    condensed = self.final_layers(image_features)
-    # rebatched = tf.reshape(condensed, tf.stack([tf.shape(conditioning['frames'])[0], tf.shape(conditioning['frames'])[1], tf.shape(condensed)[-1]], axis=0))
-    rebatched = tf.reshape(condensed, [1, 45, 2048])
+    condensed = tf.cast(self.final_layers(image_features), tf.float32)
+    # [batch * n_frames, ch] -> [batch, n_frames, ch].
+    rebatched = tf.reshape(
+        condensed,
+        tf.concat([tf.shape(frames)[:2], tf.shape(condensed)[-1:]], axis=0))
     # Normalize.
-    z = self.z_norm(rebatched[:, :, tf.newaxis, :])[:, :, 0, :]
+    z = self.z_norm(rebatched)
     # Run an RNN over the latents.
     z = self.rnn(z)
     # Bounce down to compressed z dimensions.
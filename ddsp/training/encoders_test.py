@@ -0,0 +1,120 @@
+# Copyright 2020 The DDSP Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lint as: python3
+"""Tests for ddsp.training.encoders."""
+
+from absl.testing import parameterized
+from ddsp import core
+from ddsp import spectral_ops
+from ddsp.training import encoders
+from ddsp.training import nn
+import numpy as np
+import tensorflow.compat.v2 as tf
+
+tfkl = tf.keras.layers
+
+
+class DropoutEncoder(nn.DictLayer):
+  """Encoder whose output depends on the training mode."""
+
+  def __init__(self):
+    super().__init__(input_keys=('x',), output_keys=('y',))
+    self.dropout = tfkl.Dropout(0.5)
+
+  def call(self, x, training=None):
+    return self.dropout(x, training=training)
+
+
+class ZEncoderTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.named_parameters(
+      ('upsample_2x', 125, 250),
+      ('upsample_4x', 250, 1000),
+      ('downsample_2x', 250, 125),
+  )
+  def test_expand_z_matches_resample(self, n_in, n_out):
+    encoder = encoders.ZEncoder()
+    z = np.random.randn(2, n_in, 16).astype(np.float32)
+
+    z_expanded = encoder.expand_z(z, n_out)
+
+    self.assertAllEqual([2, n_out, 16], z_expanded.shape.as_list())
+    self.assertAllClose(core.resample(z, n_out), z_expanded, atol=1e-5)
+
+
+class MfccTimeDistributedRnnEncoderTest(tf.test.TestCase):
+
+  def test_features_match_compute_mfcc(self):
+    # compute_mfcc() needs hi_hz=16000 to be below nyquist.
+    sample_rate = 32000
+    encoder = encoders.MfccTimeDistributedRnnEncoder(
+        mfcc_time_steps=250, sample_rate=sample_rate)
+    audio = np.random.uniform(-1.0, 1.0, (2, 16000)).astype(np.float32)
+
+    features = encoder.compute_features(audio)
+
+    mfccs = spectral_ops.compute_mfcc(audio,
+                                      sample_rate=sample_rate,
+                                      lo_hz=4.0,
+                                      hi_hz=16000.0,
+                                      fft_size=encoder.fft_size,
+                                      mel_bins=128,
+                                      mfcc_bins=40,
+                                      overlap=encoder.overlap)
+    self.assertAllClose(encoder.z_norm(mfccs), features, atol=1e-4)
+
+  def test_reduce_time_pads_and_stacks_frames(self):
+    encoder = encoders.MfccTimeDistributedRnnEncoder(time_reduction=4)
+    z = np.random.randn(2, 250, 3).astype(np.float32)
+
+    z_reduced = encoder.reduce_time(z)
+
+    # 250 frames are zero-padded to 252, then grouped in 4s.
+    self.assertAllEqual([2, 63, 12], z_reduced.shape.as_list())
+    self.assertAllEqual(z[:, :4, :].reshape(2, 12), z_reduced[:, 0])
+    self.assertAllEqual(np.zeros((2, 6)), z_reduced[:, -1, 6:])
+
+  def test_time_reduction_restores_z_time_steps(self):
+    encoder = encoders.MfccTimeDistributedRnnEncoder(
+        rnn_channels=16, z_dims=8, z_time_steps=250, time_reduction=4)
+    audio = np.random.uniform(-1.0, 1.0, (2, 64000)).astype(np.float32)
+
+    z = encoder({'audio': audio})['z']
+
+    self.assertAllEqual([2, 250, 8], z.shape.as_list())
+
+  def test_time_reduction_requires_z_time_steps(self):
+    with self.assertRaises(ValueError):
+      encoders.MfccTimeDistributedRnnEncoder(z_time_steps=None,
+                                             time_reduction=4)
+
+
+class MultiEncoderTest(tf.test.TestCase):
+
+  def test_training_mode_is_not_baked_into_trace(self):
+    encoder = encoders.MultiEncoder([DropoutEncoder()])
+    x = np.ones((2, 100), dtype=np.float32)
+
+    # Run both modes twice, in both orders.
+    for training in (True, False, True, False):
+      y = encoder({'x': x}, training=training)['y']
+      if training:
+        self.assertIn(0.0, y.numpy())
+      else:
+        self.assertAllEqual(x, y)
+
+
+if __name__ == '__main__':
+  tf.test.main()
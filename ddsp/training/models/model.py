@@ -27,6 +27,10 @@ class Model(tf.keras.Model):
   """Wrap the model function for dependency injection with gin."""
 
   def __init__(self, **kwargs):
+    # Don't cast input features down under a mixed precision policy. Networks
+    # still compute in the policy dtype, while pitch, loudness and audio reach
+    # the preprocessor, processors and losses in float32.
+    kwargs.setdefault('dtype', 'float32')
     super().__init__(**kwargs)
     self._losses_dict = {}
 
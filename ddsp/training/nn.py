@@ -81,10 +81,14 @@ class DictLayer(tfkl.Layer):
         returns a dictionary it will be returned directly, otherwise the output
         tensors will be wrapped in a dictionary {output_key: output_tensor}.
     """
-    # Merge all dictionaries provided in inputs.
-    input_dict = {}
-    for v in inputs:
-      if isinstance(v, dict):
+    # Merge all dictionaries provided in inputs. A single dict (the common
+    # case) is only read from, so it is used directly instead of copied.
+    dicts = [v for v in inputs if isinstance(v, dict)]
+    if len(dicts) == 1:
+      input_dict = dicts[0]
+    else:
+      input_dict = {}
+      for v in dicts:
         input_dict.update(v)
 
     # If any dicts provided, lookup input tensors from those dicts.
@@ -204,7 +208,9 @@ def split_to_dict(tensor, tensor_splits):
 def normalize_op(x, norm_type='layer', eps=1e-5):
   """Apply either Group, Instance, or Layer normalization, or None."""
   if norm_type is not None:
-    mb, h, w, ch = x.shape
+    # Batch size may be unknown while tracing.
+    mb = tf.shape(x)[0]
+    _, h, w, ch = x.shape
     n_groups = {'instance': ch, 'layer': 1, 'group': 32}[norm_type]
 
     x = tf.reshape(x, [mb, h, w, n_groups, ch // n_groups])
@@ -236,6 +242,11 @@ class Normalize(tfkl.Layer):
 
   def call(self, x):
     n_dims = len(x.shape)
+    if n_dims == 3 and self.norm_type == 'instance':
+      # [batch, time, ch], normalize over time without a dummy 4-D axis.
+      mean, var = tf.nn.moments(x, [1], keepdims=True)
+      x = (x - mean) / tf.sqrt(var + 1e-5)
+      return (x * self.scale[0]) + self.shift[0]
     x = ensure_4d(x)
     x = normalize_op(x, self.norm_type)
     x = (x * self.scale) + self.shift
@@ -354,24 +365,148 @@ class FcStack(tf.keras.Sequential):
     layers = [Fc(ch) for i in range(layers)]
     super().__init__(layers, **kwargs)
 
+
+@gin.register
+class GroupedFc(tfkl.Layer):
+  """Independent Dense -> LayerNorm -> Leaky ReLU layers for groups of inputs.
+
+  Equivalent to a separate Fc() per group, but computes every group with one
+  batched matmul (a block-diagonal Dense) instead of a matmul per group.
+  """
+
+  def __init__(self, ch=128, epsilon=1e-3, group_sizes=None, **kwargs):
+    """Constructor.
+
+    Args:
+      ch: Number of output channels per group.
+      epsilon: Epsilon of the layer normalization.
+      group_sizes: Number of input channels of each group, if the groups were
+        zero-padded to a common width. Sets the initialization scale of each
+        group. Defaults to the full input width for every group.
+      **kwargs: Other keras layer kwargs such as name.
+    """
+    super().__init__(**kwargs)
+    self.ch = ch
+    self.epsilon = epsilon
+    self.group_sizes = group_sizes
+
+  def build(self, x_shape):
+    n_groups, n_in = int(x_shape[-2]), int(x_shape[-1])
+    group_sizes = self.group_sizes or [n_in] * n_groups
+
+    # Same glorot uniform scale as a separate Dense layer for each group.
+    def kernel_initializer(shape, dtype=tf.float32):
+      fan_in = tf.constant(group_sizes, dtype=tf.float32)
+      limit = tf.sqrt(6.0 / (fan_in + self.ch))[:, tf.newaxis, tf.newaxis]
+      return tf.random.uniform(shape, -1.0, 1.0, dtype=dtype) * limit
+
+    self.kernel = self.add_weight(
+        name='kernel',
+        shape=[n_groups, n_in, self.ch],
+        initializer=kernel_initializer)
+    self.bias = self.add_weight(
+        name='bias',
+        shape=[n_groups, self.ch],
+        initializer=tf.zeros_initializer)
+    self.scale = self.add_weight(
+        name='scale',
+        shape=[n_groups, self.ch],
+        initializer=tf.ones_initializer)
+    self.shift = self.add_weight(
+        name='shift',
+        shape=[n_groups, self.ch],
+        initializer=tf.zeros_initializer)
+
+  def call(self, x):
+    """Takes x of shape [..., n_groups, n_in], returns [..., n_groups, ch]."""
+    x = tf.einsum('...gi,gio->...go', x, self.kernel) + self.bias
+    mean, var = tf.nn.moments(x, axes=[-1], keepdims=True)
+    x = (x - mean) * tf.math.rsqrt(var + self.epsilon)
+    x = x * self.scale + self.shift
+    return tf.nn.leaky_relu(x)
+
+
+@gin.register
+class GroupedFcStack(tfkl.Layer):
+  """A separate FcStack for each input, computed as one grouped stack."""
+
+  def __init__(self, ch=256, layers=2, **kwargs):
+    super().__init__(**kwargs)
+    self.ch = ch
+    self.n_layers = layers
+
+  def build(self, input_shapes):
+    # The first layer sees zero-padded inputs, so give it the real widths.
+    group_sizes = [int(shape[-1]) for shape in input_shapes]
+    self.fc_layers = [GroupedFc(self.ch, group_sizes=group_sizes)]
+    self.fc_layers += [GroupedFc(self.ch) for _ in range(self.n_layers - 1)]
+
+  def call(self, inputs):
+    """Run a list of inputs through their own stacks.
+
+    Args:
+      inputs: List of tensors of shape [..., n_in_i]. All leading dimensions
+        must match, but the number of channels can differ per input.
+
+    Returns:
+      Outputs of every stack concatenated in order, shape [..., n_inputs * ch].
+    """
+    # Zero-pad to a common width. The padded channels do not change the matmul.
+    n_in = max(int(x.shape[-1]) for x in inputs)
+    padded = []
+    for x in inputs:
+      n_pad = n_in - int(x.shape[-1])
+      padded.append(core.pad_axis(x, [0, n_pad], axis=len(x.shape) - 1))
+    x = tf.stack(padded, axis=-2)
+    for layer in self.fc_layers:
+      x = layer(x)
+    out_shape = tf.concat([tf.shape(x)[:-2], [len(inputs) * self.ch]], axis=0)
+    return tf.reshape(x, out_shape)
+
 def embedding(vocab_size, output_dim):
   return tf.keras.layers.Embedding(vocab_size, output_dim)
 
 def temporal_cnn(filters, kernel_size, causal=True):
+  """Convolution over time of [batch, time, channels] inputs.
+
+  A single channels_last Conv1D, which TF runs as a 2-D cuDNN convolution
+  (im2col + GEMM) rather than a per-timestep loop.
+  """
   if causal:
     padding = 'causal'
   else:
     padding = 'same'
-  return tf.keras.layers.Conv1D(filters, kernel_size, padding=padding, activation=tf.nn.leaky_relu)
+  return tf.keras.layers.Conv1D(filters, kernel_size, padding=padding, data_format='channels_last', activation=tf.nn.leaky_relu)
 
 @gin.register
 class Rnn(tfkl.Layer):
   """Single RNN layer."""
 
   def __init__(self, dims, rnn_type, return_sequences=True, **kwargs):
+    """Constructor.
+
+    Args:
+      dims: Number of units of the RNN.
+      rnn_type: Either 'gru' or 'lstm'.
+      return_sequences: Return the output at every time step, [batch, time,
+        dims]. Set to False when only a summary of the sequence is needed, to
+        return just the last output, [batch, dims], and skip collecting the
+        per-step outputs.
+      **kwargs: Other keras layer kwargs such as name.
+    """
     super().__init__(**kwargs)
     rnn_class = {'lstm': tfkl.LSTM, 'gru': tfkl.GRU}[rnn_type]
-    self.rnn = rnn_class(dims, return_sequences=return_sequences)
+    # Pin the arguments the fused cuDNN kernel requires, so the layer doesn't
+    # silently fall back to the much slower generic implementation on GPU.
+    cudnn_kwargs = dict(activation='tanh',
+                        recurrent_activation='sigmoid',
+                        recurrent_dropout=0.0,
+                        unroll=False,
+                        use_bias=True)
+    if rnn_type == 'gru':
+      cudnn_kwargs['reset_after'] = True
+    self.rnn = rnn_class(dims, return_sequences=return_sequences,
+                         **cudnn_kwargs)
 
   def call(self, x):
     return self.rnn(x)
@@ -158,5 +158,65 @@ class SplitToDictTest(tf.test.TestCase):
     self.assertAllEqual(x3, output.get('x3'))
 
 
+class NormalizeTest(tf.test.TestCase):
+
+  def test_instance_norm_3d_matches_4d(self):
+    x = np.random.randn(2, 10, 4).astype(np.float32)
+    norm = nn.Normalize('instance')
+
+    output_3d = norm(x)
+    output_4d = norm(x[:, :, np.newaxis, :])[:, :, 0, :]
+
+    self.assertAllEqual([2, 10, 4], output_3d.shape.as_list())
+    self.assertAllClose(output_4d, output_3d)
+
+  def test_layer_norm_traces_with_unknown_batch(self):
+    norm = nn.Normalize('layer')
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 10, 2, 4])])
+    def normalize(x):
+      return norm(x)
+
+    output = normalize(np.random.randn(3, 10, 2, 4).astype(np.float32))
+
+    self.assertAllEqual([3, 10, 2, 4], output.shape.as_list())
+
+
+class GroupedFcStackTest(tf.test.TestCase):
+
+  def test_output_shape_is_correct(self):
+    inputs = [tf.ones([2, 10, 1]), tf.ones([2, 10, 1]), tf.ones([2, 10, 16])]
+    stack = nn.GroupedFcStack(ch=8, layers=2)
+
+    output = stack(inputs)
+
+    self.assertAllEqual([2, 10, 24], output.shape.as_list())
+
+  def test_groups_are_independent(self):
+    stack = nn.GroupedFcStack(ch=8, layers=2)
+    x1 = np.random.randn(2, 10, 4).astype(np.float32)
+    x2 = np.random.randn(2, 10, 3).astype(np.float32)
+
+    output = stack([x1, x2])
+    output_changed_x1 = stack([x1 + 1.0, x2])
+
+    # Only the first group's outputs depend on the first input.
+    self.assertNotAllClose(output[..., :8], output_changed_x1[..., :8])
+    self.assertAllClose(output[..., 8:], output_changed_x1[..., 8:])
+
+  def test_init_scale_uses_unpadded_width(self):
+    tf.random.set_seed(0)
+    stack = nn.GroupedFcStack(ch=8, layers=1)
+    stack([tf.ones([2, 10, 1]), tf.ones([2, 10, 64])])
+    kernel = stack.fc_layers[0].kernel.numpy()
+
+    # Glorot limits of a separate Dense layer for 1 and 64 inputs.
+    narrow_limit = np.sqrt(6.0 / (1 + 8))
+    wide_limit = np.sqrt(6.0 / (64 + 8))
+    self.assertGreater(np.max(np.abs(kernel[0, 0])), wide_limit)
+    self.assertLessEqual(np.max(np.abs(kernel[0, 0])), narrow_limit)
+    self.assertLessEqual(np.max(np.abs(kernel[1])), wide_limit)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -40,6 +40,12 @@ def at_least_3d(x):
 class Preprocessor(tfkl.Layer):
   """Base class for chaining a series of preprocessing functions."""
 
+  def __init__(self, **kwargs):
+    # Features such as f0_hz are passed on to the synths, so keep them float32
+    # under a mixed precision policy.
+    kwargs.setdefault('dtype', 'float32')
+    super().__init__(**kwargs)
+
   def call(self, features, **kwargs):
     """Get outputs after preprocessing functions.
 
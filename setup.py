@@ -64,6 +64,7 @@ setuptools.setup(
             'avro-python3!=1.9.2',
             'apache_beam',
         ],
+        'quantization': ['tensorflow-model-optimization'],
         'test': ['pytest', 'pylint!=2.5.0'],
     },
     entry_points={